@@ -1,29 +1,42 @@
 # mcp_enhance.py - AI 标注插件 for TrendRadar
+import asyncio
+import hashlib
+import io
+import re
 import requests
-import time
 import json
 import os
+import sqlite3
+import time
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _loads(data):
+    """反序列化 JSON：orjson 可用时更快，且跳过 res.json() 的字符集嗅探"""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
 
 MCP_SERVER_URL = "http://localhost:3333/mcp"
 
-def is_mcp_available():
-    try:
-        res = requests.post(MCP_SERVER_URL, json={"jsonrpc": "2.0", "method": "mcp/ping", "id": 1}, timeout=2)
-        return res.status_code == 200
-    except:
-        return False
+# 从 <li><a href="...">标题</a> 行中提取标题；预编译一次，循环内直接 search
+_LI_RE = re.compile(r'<a\b[^>]*href=[^>]*>([^<]+)</a>')
 
-def annotate_news_with_ai(news_list):
-    if not is_mcp_available():
-        print("⚠️ MCP 服务未运行，跳过 AI 标注")
-        return news_list
-    
-    annotated = []
-    for i, item in enumerate(news_list):
-        title = item.get("title", "")
-        platform = item.get("platform", "")
-        # 构造 prompt
-        prompt = f"""你是一位资深A股事件驱动型投资分析师。请分析以下新闻：
+# 异步并发上限，避免瞬间打满 MCP 服务
+MCP_MAX_CONCURRENCY = 16
+
+# prompt 模板与 JSON-RPC 固定字段提升为模块常量，避免每条新闻重建同样的字符串
+_PROMPT_TMPL = """你是一位资深A股事件驱动型投资分析师。请分析以下新闻：
 【新闻标题】{title}
 【来源平台】{platform}
 要求：
@@ -35,50 +48,310 @@ def annotate_news_with_ai(news_list):
 输出格式（严格按此JSON）：
 {{"event_type": "...", "benefit_sectors": ["...", "..."], "small_cap_stocks": ["...", "..."], "risk_note": "..."}}
 """
+
+_RPC_VERSION = "2.0"
+_RPC_METHOD = "mcp/invoke_tool"
+_RPC_TOOL = "mcp/talk_with_model"
+
+# 标注结果落盘缓存：标题跨运行大量重复，命中缓存的条目完全不走网络
+_AI_CACHE_PATH = Path(".cache/ai_annotations.db")
+_AI_CACHE_TTL = 86400  # 秒
+
+
+class _AnnotationCache:
+    """sha1(标题+平台) -> 标注 JSON 的 sqlite 小缓存
+
+    任何读写异常都按未命中/不缓存处理，不影响标注主流程。
+    """
+
+    def __init__(self, path=_AI_CACHE_PATH):
+        self._path = Path(path)
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self._path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS annotations (key TEXT PRIMARY KEY, value TEXT, ts REAL)"
+            )
+        return self._conn
+
+    def get(self, key):
+        try:
+            row = self._db().execute(
+                "SELECT value, ts FROM annotations WHERE key = ?", (key,)
+            ).fetchone()
+            if row and time.time() - row[1] < _AI_CACHE_TTL:
+                return _loads(row[0])
+        except Exception:
+            pass
+        return None
+
+    def set(self, key, value):
+        try:
+            self._db().execute(
+                "INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            self._db().commit()
+        except Exception:
+            pass
+
+
+_AI_CACHE = _AnnotationCache()
+
+def _cache_key(item):
+    title = item.get("title", "")
+    platform = item.get("platform", "")
+    return hashlib.sha1(f"{title}\0{platform}".encode()).hexdigest()
+
+def _split_cached(news_list):
+    """用缓存直接填充命中的条目，返回仍需请求的条目"""
+    pending = []
+    for item in news_list:
+        cached = _AI_CACHE.get(_cache_key(item))
+        if cached is not None:
+            item["ai_annotation"] = cached
+        else:
+            pending.append(item)
+    return pending
+
+# 复用同一个 Session：连接池 + Keep-Alive，避免每次请求重建 TCP/TLS 连接
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.1),
+))
+_SESSION.headers["Connection"] = "keep-alive"
+
+def close_mcp_session():
+    """关闭 MCP 连接池（进程退出前调用）"""
+    _SESSION.close()
+
+# 可用性探测结果短暂缓存，避免每次标注都先发一次 ping
+_AVAIL_CACHE = {"ok": None, "ts": 0.0}
+_AVAIL_TTL = 30  # 秒
+
+def is_mcp_available():
+    now = time.time()
+    if _AVAIL_CACHE["ok"] is not None and now - _AVAIL_CACHE["ts"] < _AVAIL_TTL:
+        return _AVAIL_CACHE["ok"]
+    try:
+        res = _SESSION.post(MCP_SERVER_URL, json={"jsonrpc": "2.0", "method": "mcp/ping", "id": 1}, timeout=2)
+        ok = res.status_code == 200
+    except:
+        ok = False
+    _AVAIL_CACHE["ok"] = ok
+    _AVAIL_CACHE["ts"] = now
+    return ok
+
+
+class MCPSessionPool:
+    """按端点复用 httpx.AsyncClient 的会话池
+
+    长生命周期进程里每次标注都新建客户端会重做连接建立等握手开销，
+    这里把客户端按 URL 缓存在 asyncio.Queue 中，带 TTL 过期和关闭检查。
+    """
+
+    def __init__(self, max_size=4, ttl=300):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._pools = {}  # url -> asyncio.Queue[(client, 创建时间, 所属事件循环)]
+
+    def _queue(self, url):
+        if url not in self._pools:
+            self._pools[url] = asyncio.Queue(maxsize=self._max_size)
+        return self._pools[url]
+
+    async def acquire(self, url):
+        """取出一个可用客户端；过期、已关闭或属于其他事件循环的直接淘汰
+
+        客户端持有的保活连接绑定在创建它的事件循环上，asyncio.run 每次
+        都新建并销毁循环，跨循环复用会在旧连接上抛 "Event loop is closed"。
+        """
+        loop = asyncio.get_running_loop()
+        q = self._queue(url)
+        while not q.empty():
+            client, born, client_loop = q.get_nowait()
+            if (client_loop is loop and not client.is_closed
+                    and time.time() - born < self._ttl):
+                return client, born
+            if client_loop is loop:
+                await client.aclose()
+            # 其他循环的客户端无法在本循环安全关闭，直接丢弃交给 GC
+        return self._new_client(), time.time()
+
+    @staticmethod
+    def _new_client():
+        """创建支持 HTTP/2 的客户端
+
+        协商到 h2 时（TLS ALPN）httpx 会把并发流多路复用到一条连接上；
+        明文 http:// 只能走 HTTP/1.1，此时靠连接池并行，连接上限不能收紧
+        到 1，否则整个异步路径退化为串行。h2 未安装则按 HTTP/1.1 创建。
+        """
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        try:
+            return httpx.AsyncClient(http2=True, limits=limits)
+        except ImportError:
+            return httpx.AsyncClient(limits=limits)
+
+    async def release(self, url, client, born):
+        """归还客户端；池满或已过期则关闭"""
+        q = self._queue(url)
+        if client.is_closed or time.time() - born >= self._ttl or q.full():
+            await client.aclose()
+        else:
+            q.put_nowait((client, born, asyncio.get_running_loop()))
+
+    async def close(self):
+        """关闭池内全部客户端；非本循环的客户端只能丢弃"""
+        loop = asyncio.get_running_loop()
+        for q in self._pools.values():
+            while not q.empty():
+                client, _, client_loop = q.get_nowait()
+                if client_loop is loop:
+                    await client.aclose()
+
+
+_SESSION_POOL = MCPSessionPool()
+
+def _build_invoke_payload(i, item):
+    """构造单条新闻的 JSON-RPC invoke_tool 请求体"""
+    prompt = _PROMPT_TMPL.format(
+        title=item.get("title", ""),
+        platform=item.get("platform", ""),
+    )
+    return {
+        "jsonrpc": _RPC_VERSION,
+        "method": _RPC_METHOD,
+        "params": {
+            "name": _RPC_TOOL,
+            "arguments": {
+                "messages": [{"role": "user", "content": prompt}]
+            }
+        },
+        "id": i+1
+    }
+
+def _apply_result(item, result):
+    """把单条 JSON-RPC 响应写回新闻条目"""
+    if result and "result" in result and "content" in result["result"]:
+        try:
+            ai_data = _loads(result["result"]["content"])
+            item["ai_annotation"] = ai_data
+            # 解析成功才落盘，错误结果不缓存
+            _AI_CACHE.set(_cache_key(item), ai_data)
+        except:
+            item["ai_annotation"] = {"error": "解析失败"}
+
+async def annotate_news_with_ai_async(news_list):
+    """异步并发标注：所有请求同时在途，总耗时约为最慢一条而非各条之和"""
+    if not news_list:
+        return news_list
+
+    # 命中缓存的条目直接回填，只为未命中的发请求
+    pending = _split_cached(news_list)
+    if not pending:
+        return news_list
+
+    if not is_mcp_available():
+        print("⚠️ MCP 服务未运行，跳过 AI 标注")
+        return news_list
+
+    sem = asyncio.Semaphore(MCP_MAX_CONCURRENCY)
+    client, born = await _SESSION_POOL.acquire(MCP_SERVER_URL)
+    try:
+        async def _post(i, item):
+            async with sem:
+                return await client.post(MCP_SERVER_URL, json=_build_invoke_payload(i, item), timeout=5)
+
+        tasks = [_post(i, item) for i, item in enumerate(pending)]
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await _SESSION_POOL.release(MCP_SERVER_URL, client, born)
+
+    for item, res in zip(pending, responses):
+        if isinstance(res, Exception):
+            item["ai_annotation"] = {"error": str(res)}
+        elif res.status_code == 200:
+            try:
+                _apply_result(item, _loads(res.content))
+            except:
+                item["ai_annotation"] = {"error": "解析失败"}
+    return news_list
+
+async def _annotate_and_drain(news_list):
+    """asyncio.run 退出即销毁事件循环，连接无法跨循环保活，返回前清空会话池"""
+    try:
+        return await annotate_news_with_ai_async(news_list)
+    finally:
+        await _SESSION_POOL.close()
+
+def annotate_news_with_ai(news_list):
+    # 优先走异步并发路径；httpx 不可用时退回单次批量请求
+    if HAS_HTTPX:
         try:
-            res = requests.post(MCP_SERVER_URL, json={
-                "jsonrpc": "2.0",
-                "method": "mcp/invoke_tool",
-                "params": {
-                    "name": "mcp/talk_with_model",
-                    "arguments": {
-                        "messages": [{"role": "user", "content": prompt}]
-                    }
-                },
-                "id": i+1
-            }, timeout=5)
-            
-            if res.status_code == 200:
-                result = res.json()
-                if "result" in result and "content" in result["result"]:
-                    try:
-                        ai_data = json.loads(result["result"]["content"])
-                        item["ai_annotation"] = ai_data
-                    except:
-                        item["ai_annotation"] = {"error": "解析失败"}
-            time.sleep(0.2)  # 防限流
-        except Exception as e:
-            item["ai_annotation"] = {"error": str(e)}
-        annotated.append(item)
-    return annotated
+            return asyncio.run(_annotate_and_drain(news_list))
+        except RuntimeError:
+            pass  # 已在事件循环中，退回同步路径
+    if not news_list:
+        return news_list
+
+    # 命中缓存的条目直接回填，只为未命中的发请求
+    pending = _split_cached(news_list)
+    if not pending:
+        return news_list
+
+    if not is_mcp_available():
+        print("⚠️ MCP 服务未运行，跳过 AI 标注")
+        return news_list
+
+    # 构造 JSON-RPC 批量请求：未命中缓存的新闻打包为一个数组，一次 POST 完成
+    # （逐条请求需要 N 次网络往返，批量后只需 1 次）
+    batch_payload = [_build_invoke_payload(i, item) for i, item in enumerate(pending)]
+
+    try:
+        res = _SESSION.post(MCP_SERVER_URL, json=batch_payload, timeout=30)
+
+        if res.status_code == 200:
+            responses = _loads(res.content)
+            # 兼容不支持批量的服务端（返回单个对象而非数组）
+            if isinstance(responses, dict):
+                responses = [responses]
+            # 按 id 映射回对应的新闻条目
+            results_by_id = {r.get("id"): r for r in responses if isinstance(r, dict)}
+            for i, item in enumerate(pending):
+                _apply_result(item, results_by_id.get(i+1))
+    except Exception as e:
+        for item in pending:
+            if "ai_annotation" not in item:
+                item["ai_annotation"] = {"error": str(e)}
+    return news_list
 
 def add_ai_html_blocks(html_content, news_groups):
     """在 HTML 报告中插入 AI 标注区块"""
-    lines = html_content.split('\n')
-    new_lines = []
-    in_news_item = False
-    for line in lines:
-        new_lines.append(line)
+    # 先把所有标注压平成 标题 -> 标注 的字典，循环内一次哈希查找即可，
+    # 不再对每一行重复遍历所有分组和条目
+    ann_by_title = {
+        item["title"]: item["ai_annotation"]
+        for group in news_groups
+        for item in group.get("news", [])
+        if item.get("title") and "ai_annotation" in item
+    }
+
+    # 流式写入 StringIO：不再物化整份行列表再重新 join，峰值内存减半
+    buf = io.StringIO()
+    for line in html_content.splitlines(keepends=True):
+        buf.write(line)
         # 在每条新闻后插入 AI block（简单匹配）
-        if line.strip().startswith('<li>') and 'href=' in line:
-            # 找到对应新闻，插入标注
-            title_match = line.split('">')[1].split('</a>')[0] if '">' in line and '</a>' in line else ""
-            for group in news_groups:
-                for item in group.get("news", []):
-                    if title_match in item.get("title", "") and "ai_annotation" in item:
-                        ann = item["ai_annotation"]
-                        if ann and "error" not in ann:
-                            block = f'''
+        if line.strip().startswith('<li>'):
+            match = _LI_RE.search(line)
+            if not match:
+                continue
+            ann = ann_by_title.get(match.group(1))
+            if ann and "error" not in ann:
+                block = f'''
                             <div class="ai-annotation" style="background:#f8f9fa; padding:8px; border-left:3px solid #1976d2; margin:8px 0; font-size:0.9em;">
                               🤖 <b>AI分析</b>：{ann.get("event_type", "")}<br>
                               ✅ <b>受益环节</b>：{", ".join(ann.get("benefit_sectors", []))}<br>
@@ -86,5 +359,6 @@ def add_ai_html_blocks(html_content, news_groups):
                               ⚠️ <b>风险提示</b>：{ann.get("risk_note", "")}
                             </div>
                             '''
-                            new_lines.append(block)
-    return '\n'.join(new_lines)
\ No newline at end of file
+                buf.write(block)
+                buf.write('\n')
+    return buf.getvalue()
\ No newline at end of file
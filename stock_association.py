@@ -1,7 +1,26 @@
+import hashlib
+import heapq
 import json
 import os
+import pickle
+import re
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 已解析配置缓存：路径 -> (mtime, 配置字典)，同进程内重复实例化时复用解析结果
+_CONFIG_CACHE: Dict[Path, Tuple[float, Dict]] = {}
 
 
 class StockAssociator:
@@ -21,6 +40,11 @@ class StockAssociator:
         self.config_path = Path(config_path)
         self.stock_mappings = []
         self.industry_mappings = []
+        self._kw_entries = {}
+        self._ac = None
+        self._kw_re = None
+        self._re_contained = {}
+        self._global_first_chars = frozenset()
         self._load_config()
     
     def _load_config(self) -> None:
@@ -30,109 +54,238 @@ class StockAssociator:
             return
         
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-            
+            # mtime 未变则直接复用上次的解析结果；orjson 可用时解析大配置更快
+            mtime = self.config_path.stat().st_mtime
+            cached = _CONFIG_CACHE.get(self.config_path)
+            if cached is not None and cached[0] == mtime:
+                config = cached[1]
+            else:
+                with open(self.config_path, 'rb') as f:
+                    data = f.read()
+                config = orjson.loads(data) if orjson is not None else json.loads(data)
+                _CONFIG_CACHE[self.config_path] = (mtime, config)
+
             self.stock_mappings = config.get("股票映射配置", [])
             self.industry_mappings = config.get("行业板块映射", [])
-            
+
+            self._build_matcher()
+
             print(f"已加载 {len(self.stock_mappings)} 个股票映射和 {len(self.industry_mappings)} 个行业板块映射")
-        
+
         except Exception as e:
             print(f"加载股票关键词映射配置失败: {str(e)}")
+
+    def _build_matcher(self) -> None:
+        """构建关键词匹配器
+
+        把所有关键词编入一个 Aho-Corasick 自动机，每个标题只需一次线性扫描，
+        替代「每只股票 × 每个关键词」的嵌套子串查找。pyahocorasick 未安装时
+        退回标准库 re 的关键词交替正则，扫描同样在 C 层完成，无需第三方依赖。
+        """
+        # 关键词是静态配置，casefold 形式在加载时算好，避免每个标题都重复折叠
+        for mapping in self.stock_mappings:
+            mapping["_kw_cf"] = tuple(k.casefold() for k in mapping.get("关联关键词", []))
+        for mapping in self.industry_mappings:
+            mapping["_kw_cf"] = tuple(k.casefold() for k in mapping.get("关联关键词", []))
+
+        # casefold 关键词 -> [(类型, 映射下标)]，同一关键词可能关联多只股票/板块
+        self._kw_entries = {}
+        for idx, stock in enumerate(self.stock_mappings):
+            for keyword_cf in stock["_kw_cf"]:
+                if keyword_cf:
+                    self._kw_entries.setdefault(keyword_cf, []).append(("stock", idx))
+        for idx, industry in enumerate(self.industry_mappings):
+            for keyword_cf in industry["_kw_cf"]:
+                if keyword_cf:
+                    self._kw_entries.setdefault(keyword_cf, []).append(("industry", idx))
+
+        # 所有关键词的首字符集合：标题中一个都不含时可直接判定无匹配，
+        # 新闻流里大部分标题不含任何关注标的，这条快速路径收益最大
+        self._global_first_chars = frozenset(kw[0] for kw in self._kw_entries)
+
+        self._ac = None
+        self._kw_re = None
+        self._re_contained = {}
+        if not self._kw_entries:
+            return
+
+        # 配置很少变动，把编译好的匹配器按关键词摘要落盘，
+        # 下次启动直接反序列化，省去逐关键词重建
+        kind = "ac" if ahocorasick is not None else "re"
+        digest = hashlib.blake2b(
+            json.dumps(sorted(self._kw_entries)).encode()
+        ).hexdigest()[:16]
+        cache_path = self.config_path.with_suffix(f".{digest}.{kind}.pkl")
+
+        cached = self._load_prebuilt_matcher(cache_path, kind)
+        if cached is not None:
+            if kind == "ac":
+                self._ac = cached
+            else:
+                self._kw_re, self._re_contained = cached
+            return
+
+        if kind == "ac":
+            automaton = ahocorasick.Automaton()
+            for keyword_cf in self._kw_entries:
+                automaton.add_word(keyword_cf, keyword_cf)
+            automaton.make_automaton()
+            self._ac = automaton
+            built = automaton
+        else:
+            # 长度降序的前瞻交替正则：每个起始位置报告在此开头的最长关键词，
+            # 被更长命中遮蔽的短关键词由包含关系表在扫描后补齐
+            keywords = sorted(self._kw_entries, key=len, reverse=True)
+            pattern = re.compile("(?=(" + "|".join(map(re.escape, keywords)) + "))")
+            contained = {}
+            for keyword_cf in keywords:
+                subs = [
+                    other for other in self._kw_entries
+                    if other != keyword_cf and other in keyword_cf
+                ]
+                if subs:
+                    contained[keyword_cf] = tuple(subs)
+            self._kw_re = pattern
+            self._re_contained = contained
+            built = (pattern, contained)
+
+        self._save_prebuilt_matcher(cache_path, kind, built)
+
+    @staticmethod
+    def _load_prebuilt_matcher(cache_path: Path, kind: str):
+        """尝试读取落盘的匹配器；类型不符或读取失败都当作未命中"""
+        if not cache_path.exists():
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_kind, payload = pickle.load(f)
+            if cached_kind == kind:
+                return payload
+        except Exception:
+            pass
+        return None
+
+    @staticmethod
+    def _save_prebuilt_matcher(cache_path: Path, kind: str, built) -> None:
+        """把编译好的匹配器写到配置文件旁边；写失败不影响正常使用"""
+        try:
+            with open(cache_path, 'wb') as f:
+                pickle.dump((kind, built), f)
+        except Exception:
+            pass
+
+    def _scan_keywords(self, title_cf: str) -> Set[str]:
+        """单次扫描标题，返回命中的 casefold 关键词集合"""
+        # 首字符预筛：标题与全部关键词的首字符集合不相交时无需扫描
+        if self._global_first_chars.isdisjoint(title_cf):
+            return set()
+
+        if self._ac is not None:
+            return {keyword for _, keyword in self._ac.iter(title_cf)}
+
+        if self._kw_re is None:
+            return set()
+        hits = set(self._kw_re.findall(title_cf))
+        # 补上被更长命中遮蔽的包含关键词
+        for keyword_cf in tuple(hits):
+            hits.update(self._re_contained.get(keyword_cf, ()))
+        return hits
+
+    def _matched_by_index(self, hits: Set[str], kind: str) -> Dict[int, Set[str]]:
+        """把命中的关键词按股票/板块下标归桶"""
+        matched = {}
+        for keyword_cf in hits:
+            for entry_kind, idx in self._kw_entries.get(keyword_cf, ()):
+                if entry_kind == kind:
+                    matched.setdefault(idx, set()).add(keyword_cf)
+        return matched
     
-    def find_related_stocks(self, title: str) -> List[Dict]:
+    def find_related_stocks(self, title_cf: str) -> List[Dict]:
         """根据新闻标题查找相关股票
-        
+
         Args:
-            title: 新闻标题
-            
+            title_cf: 已 casefold 的新闻标题
+
         Returns:
             相关股票列表，每个元素包含股票代码、股票名称和匹配的关键词
         """
         related_stocks = []
-        title_lower = title.lower()
-        
-        for stock in self.stock_mappings:
-            stock_name = stock["股票名称"]
-            stock_code = stock["股票代码"]
-            keywords = stock["关联关键词"]
-            
-            matched_keywords = []
-            for keyword in keywords:
-                if keyword.lower() in title_lower:
-                    matched_keywords.append(keyword)
-            
-            if matched_keywords:
-                related_stocks.append({
-                    "股票代码": stock_code,
-                    "股票名称": stock_name,
-                    "匹配关键词": matched_keywords,
-                    "匹配强度": len(matched_keywords)  # 匹配的关键词数量作为强度指标
-                })
-        
-        # 按匹配强度降序排序
-        related_stocks.sort(key=lambda x: x["匹配强度"], reverse=True)
+
+        # 标题只扫描一次，再按命中归桶
+        hits = self._scan_keywords(title_cf)
+        matched = self._matched_by_index(hits, "stock")
+        for idx in sorted(matched):
+            stock = self.stock_mappings[idx]
+            hit_set = matched[idx]
+            # 保持关键词在配置中的原始顺序
+            matched_keywords = [
+                keyword for keyword, keyword_cf
+                in zip(stock["关联关键词"], stock["_kw_cf"])
+                if keyword_cf in hit_set
+            ]
+            related_stocks.append({
+                "股票代码": stock["股票代码"],
+                "股票名称": stock["股票名称"],
+                "匹配关键词": matched_keywords,
+                "匹配强度": len(matched_keywords)  # 匹配的关键词数量作为强度指标
+            })
         
-        return related_stocks[:3]  # 返回前3个最相关的股票
+        # 按匹配强度取前3，nlargest 只维护大小为3的堆，免去整表排序
+        return heapq.nlargest(3, related_stocks, key=itemgetter("匹配强度"))
     
-    def find_related_industries(self, title: str) -> List[Dict]:
+    def find_related_industries(self, title_cf: str) -> List[Dict]:
         """根据新闻标题查找相关行业板块
-        
+
         Args:
-            title: 新闻标题
-            
+            title_cf: 已 casefold 的新闻标题
+
         Returns:
             相关行业板块列表
         """
         related_industries = []
-        title_lower = title.lower()
-        
-        for industry in self.industry_mappings:
-            industry_name = industry["板块名称"]
-            keywords = industry["关联关键词"]
-            
-            matched_keywords = []
-            for keyword in keywords:
-                if keyword.lower() in title_lower:
-                    matched_keywords.append(keyword)
-            
-            if matched_keywords:
-                related_industries.append({
-                    "板块名称": industry_name,
-                    "匹配关键词": matched_keywords,
-                    "匹配强度": len(matched_keywords)
-                })
-        
-        # 按匹配强度降序排序
-        related_industries.sort(key=lambda x: x["匹配强度"], reverse=True)
+
+        hits = self._scan_keywords(title_cf)
+        matched = self._matched_by_index(hits, "industry")
+        for idx in sorted(matched):
+            industry = self.industry_mappings[idx]
+            hit_set = matched[idx]
+            matched_keywords = [
+                keyword for keyword, keyword_cf
+                in zip(industry["关联关键词"], industry["_kw_cf"])
+                if keyword_cf in hit_set
+            ]
+            related_industries.append({
+                "板块名称": industry["板块名称"],
+                "匹配关键词": matched_keywords,
+                "匹配强度": len(matched_keywords)
+            })
         
-        return related_industries[:2]  # 返回前2个最相关的行业板块
+        # 按匹配强度取前2，同样走 nlargest
+        return heapq.nlargest(2, related_industries, key=itemgetter("匹配强度"))
     
     def associate_title_with_stocks(self, title_data: Dict) -> Dict:
         """将股票信息关联到新闻标题数据中
         
+        直接在传入的字典上添加字段，避免为每个标题分配一份浅拷贝。
+
         Args:
-            title_data: 包含标题信息的字典
-            
+            title_data: 包含标题信息的字典（就地更新）
+
         Returns:
             更新后的标题数据，添加了相关股票和行业板块信息
         """
         title = title_data.get("title", "")
         if not title:
             return title_data
-        
-        # 查找相关股票
-        related_stocks = self.find_related_stocks(title)
-        # 查找相关行业板块
-        related_industries = self.find_related_industries(title)
-        
-        # 添加到标题数据中
-        updated_data = title_data.copy()
-        updated_data["related_stocks"] = related_stocks
-        updated_data["related_industries"] = related_industries
-        
-        return updated_data
+
+        # casefold 只做一次，两个查找函数共用；对中英混排标题比 lower() 更完整
+        title_cf = title.casefold()
+
+        # 查找相关股票和行业板块，直接写回原字典
+        title_data["related_stocks"] = self.find_related_stocks(title_cf)
+        title_data["related_industries"] = self.find_related_industries(title_cf)
+
+        return title_data
 
 
 # 全局股票关联器实例
@@ -155,83 +308,67 @@ def associate_news_with_stocks(news_data: Dict) -> Dict:
     """将股票信息关联到新闻数据中
     
     Args:
-        news_data: 新闻数据字典
-        
+        news_data: 新闻数据字典（就地更新）
+
     Returns:
-        更新后的新闻数据
+        更新后的新闻数据（与传入的是同一个字典）
     """
     associator = get_stock_associator()
-    
-    # 处理统计数据中的标题
-    stats = news_data.get("stats", [])
-    updated_stats = []
-    
-    for stat in stats:
-        updated_titles = []
+
+    # 同一标题常同时出现在 stats 和 new_titles 中，按标题缓存匹配结果避免重复扫描
+    cache: Dict[str, Tuple[List, List]] = {}
+
+    def _annotate(title_data: Dict) -> None:
+        title = title_data.get("title", "")
+        if not title:
+            return
+        cached = cache.get(title)
+        if cached is None:
+            associator.associate_title_with_stocks(title_data)
+            cache[title] = (title_data["related_stocks"], title_data["related_industries"])
+        else:
+            title_data["related_stocks"], title_data["related_industries"] = cached
+
+    # 就地更新，不再为每个标题/来源/统计项分配浅拷贝
+    for stat in news_data.get("stats", []):
         for title_data in stat.get("titles", []):
-            updated_title_data = associator.associate_title_with_stocks(title_data)
-            updated_titles.append(updated_title_data)
-        
-        updated_stat = stat.copy()
-        updated_stat["titles"] = updated_titles
-        updated_stats.append(updated_stat)
-    
-    # 处理新增标题
-    new_titles = news_data.get("new_titles", [])
-    updated_new_titles = []
-    
-    for source_data in new_titles:
-        updated_source_titles = []
+            _annotate(title_data)
+
+    for source_data in news_data.get("new_titles", []):
         for title_data in source_data.get("titles", []):
-            updated_title_data = associator.associate_title_with_stocks(title_data)
-            updated_source_titles.append(updated_title_data)
-        
-        updated_source = source_data.copy()
-        updated_source["titles"] = updated_source_titles
-        updated_new_titles.append(updated_source)
-    
-    # 返回更新后的新闻数据
-    updated_news_data = news_data.copy()
-    updated_news_data["stats"] = updated_stats
-    updated_news_data["new_titles"] = updated_new_titles
-    
-    return updated_news_data
+            _annotate(title_data)
+
+    return news_data
+
+
+# 平台 -> (单只股票格式, 整体格式)，未知平台用默认纯文本样式
+_PLATFORM_FMT = {
+    "feishu": ("<font color='blue'>[{name}({code})]</font>", " <font color='grey'>相关股票:</font> {}"),
+    "dingtalk": ("[{name}({code})]", " 相关股票: {}"),
+    "wework": ("[{name}({code})]", " 相关股票: {}"),
+    "telegram": ("<b>[{name}({code})]</b>", " <b>相关股票:</b> {}"),
+    "ntfy": ("[{name}({code})]", " 相关股票: {}"),
+}
+_PLATFORM_FMT_DEFAULT = ("[{name}({code})]", " 相关股票: {}")
 
 
 def format_stock_info(related_stocks: List[Dict], platform: str = "feishu") -> str:
     """格式化股票信息为适合不同平台的显示格式
-    
+
     Args:
         related_stocks: 相关股票列表
         platform: 平台类型 (feishu, dingtalk, wework, telegram, ntfy)
-        
+
     Returns:
         格式化后的股票信息字符串
     """
     if not related_stocks:
         return ""
-    
-    stock_info_parts = []
-    for stock in related_stocks:
-        stock_name = stock["股票名称"]
-        stock_code = stock["股票代码"]
-        
-        if platform == "feishu":
-            stock_info_parts.append(f"<font color='blue'>[{stock_name}({stock_code})]</font>")
-        elif platform in ["dingtalk", "wework"]:
-            stock_info_parts.append(f"[{stock_name}({stock_code})]")
-        elif platform == "telegram":
-            stock_info_parts.append(f"<b>[{stock_name}({stock_code})]</b>")
-        elif platform == "ntfy":
-            stock_info_parts.append(f"[{stock_name}({stock_code})]")
-        else:
-            stock_info_parts.append(f"[{stock_name}({stock_code})]")
-    
-    if platform == "feishu":
-        return f" <font color='grey'>相关股票:</font> {' '.join(stock_info_parts)}"
-    elif platform in ["dingtalk", "wework", "ntfy"]:
-        return f" 相关股票: {' '.join(stock_info_parts)}"
-    elif platform == "telegram":
-        return f" <b>相关股票:</b> {' '.join(stock_info_parts)}"
-    else:
-        return f" 相关股票: {' '.join(stock_info_parts)}"
\ No newline at end of file
+
+    # 平台样式在循环外查表一次，循环内不再逐股票走分支
+    stock_fmt, wrapper_fmt = _PLATFORM_FMT.get(platform, _PLATFORM_FMT_DEFAULT)
+    stock_info_parts = [
+        stock_fmt.format(name=stock["股票名称"], code=stock["股票代码"])
+        for stock in related_stocks
+    ]
+    return wrapper_fmt.format(' '.join(stock_info_parts))
\ No newline at end of file